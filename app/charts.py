@@ -0,0 +1,150 @@
+import matplotlib
+matplotlib.use("Agg")
+from matplotlib.figure import Figure
+import numpy as np
+import pandas as pd
+from typing import Dict, Any
+
+AGGREGATIONS = ("sum", "mean", "median", "count", "min", "max")
+
+# Scatter plots beyond this many points are drawn from a random sample
+MAX_SCATTER_POINTS = 20000
+
+# Histogram bin counts from the chart spec are clamped to this range
+MIN_BINS = 1
+MAX_BINS = 200
+
+
+def _column(df, name):
+    if name not in df.columns:
+        raise ValueError(f"Unknown column: {name}")
+    return df[name]
+
+
+def _aggregate(df, spec):
+    x = spec["x"]
+    y = spec.get("y")
+    agg = spec.get("agg", "sum" if y else "count")
+    if agg not in AGGREGATIONS:
+        raise ValueError(f"Unsupported aggregation: {agg}")
+
+    keys = _column(df, x)
+    if y is None and agg != "count":
+        raise ValueError(f"Aggregation {agg} needs a y column")
+    if y is not None and agg != "count":
+        values = pd.to_numeric(_column(df, y), errors="coerce")
+        if values.isna().all():
+            raise ValueError(f"No numeric values in column: {y}")
+
+    if y is None or agg == "count":
+        return df.groupby(keys, dropna=True).size()
+    return values.groupby(keys, dropna=True).agg(agg)
+
+
+def _bar(ax, df, spec):
+    data = _aggregate(df, spec)
+    ax.bar(data.index.astype(str), data.values)
+    ax.tick_params(axis="x", labelrotation=45)
+
+
+def _line(ax, df, spec):
+    x, y, groupby = spec["x"], spec["y"], spec.get("groupby")
+    if "agg" in spec:
+        data = _aggregate(df, spec)
+        ax.plot(data.index, data.values)
+    elif groupby:
+        for name, group in df.sort_values(x).groupby(_column(df, groupby)):
+            ax.plot(group[x], _column(group, y), label=str(name))
+        ax.legend()
+    else:
+        data = df.sort_values(_column(df, x).name)
+        ax.plot(data[x], _column(data, y))
+
+
+def _pie(ax, df, spec):
+    data = _aggregate(df, spec)
+    ax.pie(data.values, labels=data.index.astype(str), autopct="%1.1f%%")
+    ax.axis("equal")
+
+
+def _scatter(ax, df, spec):
+    x, y, groupby = spec["x"], spec["y"], spec.get("groupby")
+    if len(df) > MAX_SCATTER_POINTS:
+        df = df.sample(MAX_SCATTER_POINTS, random_state=0)
+    if groupby:
+        for name, group in df.groupby(_column(df, groupby)):
+            ax.scatter(_column(group, x), _column(group, y), label=str(name), s=10)
+        ax.legend()
+    else:
+        ax.scatter(_column(df, x), _column(df, y), s=10)
+
+
+def _histogram(ax, df, spec):
+    values = pd.to_numeric(_column(df, spec["x"]), errors="coerce").replace([np.inf, -np.inf], np.nan).dropna()
+    if values.empty:
+        raise ValueError(f"No numeric values in column: {spec['x']}")
+    nbins = min(max(int(spec.get("bins", 20)), MIN_BINS), MAX_BINS)
+    ax.hist(values, bins=nbins)
+
+
+def _box(ax, df, spec):
+    x, y = spec["x"], spec.get("y")
+    if y:
+        groups = [(str(name), _column(group, y).dropna()) for name, group in df.groupby(_column(df, x))]
+        ax.boxplot([values for _, values in groups])
+        ax.set_xticklabels([name for name, _ in groups], rotation=45)
+    else:
+        ax.boxplot(_column(df, x).dropna())
+
+
+def _heatmap(ax, df, spec):
+    x, y = spec.get("x"), spec.get("y")
+    if x and y:
+        # Aggregate a value column over two categorical axes
+        value = spec.get("value")
+        agg = spec.get("agg", "sum" if value else "count")
+        if value:
+            data = df.pivot_table(index=_column(df, y).name, columns=_column(df, x).name,
+                                  values=_column(df, value).name, aggfunc=agg)
+        else:
+            data = pd.crosstab(_column(df, y), _column(df, x))
+    else:
+        # Correlation between numeric columns
+        data = df.select_dtypes("number").corr()
+
+    image = ax.imshow(data.values, aspect="auto", cmap="viridis")
+    ax.set_xticks(range(len(data.columns)))
+    ax.set_xticklabels([str(c) for c in data.columns], rotation=45, ha="right")
+    ax.set_yticks(range(len(data.index)))
+    ax.set_yticklabels([str(i) for i in data.index])
+    ax.figure.colorbar(image, ax=ax)
+
+
+_RENDERERS = {
+    "bar": _bar,
+    "line": _line,
+    "pie": _pie,
+    "scatter": _scatter,
+    "histogram": _histogram,
+    "box": _box,
+    "heatmap": _heatmap,
+}
+
+
+def render_chart(df: pd.DataFrame, spec: Dict[str, Any], fig: Figure) -> None:
+    chart_type = spec.get("type")
+    if chart_type not in _RENDERERS:
+        raise ValueError(f"Unsupported chart type: {chart_type}")
+
+    # Fresh axes per chart: cla() keeps aspect, frame and tick settings from
+    # the previous chart (e.g. a pie's equal aspect), and clear() also drops colorbars
+    fig.clear()
+    ax = fig.add_subplot()
+
+    _RENDERERS[chart_type](ax, df, spec)
+
+    ax.set_title(spec.get("title", ""))
+    if chart_type not in ("pie", "heatmap"):
+        ax.set_xlabel(spec.get("x", ""))
+        ax.set_ylabel(spec.get("y") or spec.get("agg", "count"))
+    fig.tight_layout()
@@ -1,21 +1,100 @@
 from langgraph.graph import StateGraph, START, END
-from typing import TypedDict, Dict, Any, List
+from typing import TypedDict, Dict, Any, List, Tuple, AsyncIterator
 import pandas as pd 
-from app.profiler import parse_excel, basic_summary, profile_to_json
-from app.llm_client import client
-import matplotlib.pyplot as plt
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.utils import ImageReader
-from reportlab.lib.units import inch
-from io import BytesIO
-import ast
+from app.profiler import parse_csv, parse_excel, profile_sheet
+from app.llm_client import client, llm_semaphore
+from app.render import render_sheet_pdf
+from app.workers import process_executor
+from diskcache import Cache
+import hashlib
+import orjson
+import asyncio
 import os
 
 BASE_DIR = os.path.dirname(__file__) 
 REPORT_DIR = os.path.join(BASE_DIR, "generated_reports")
 os.makedirs(REPORT_DIR, exist_ok=True)
 
+# LLM responses keyed by a hash of the request, so re-uploads of the same data skip the API call
+llm_cache = Cache(os.path.join(BASE_DIR, "llm_cache"))
+
+# Number of sheets sent together in one LLM request
+SHEET_BATCH_SIZE = int(os.getenv("SHEET_BATCH_SIZE", "4"))
+
+# Output token budget for one batched reply; must not exceed the deployment's output limit
+MAX_OUTPUT_TOKENS = int(os.getenv("AZURE_OPENAI_MAX_TOKENS", "4096"))
+
+# System prompts are kept byte-identical across requests so the shared prefix can be served
+# from the provider's prompt cache; all per-sheet data goes in the user message
+INSIGHTS_SYSTEM_PROMPT = """\
+You are a business insights agent. Your role is to generate clear, actionable, and relevant textual insights based on structured data.
+
+You will be given a JSON array with one entry per sheet of an Excel file. Each entry contains:
+
+sheet_name: the name of the sheet.
+summary: a basic summary of the sheet, including row/column counts, data types, missing values, unique values, and sample entries.
+profile: a data profile description, which includes detailed statistical and structural metadata about the sheet.
+
+For every sheet, analyze this information and generate at most 4 applicable business insights that can be inferred from the data.
+These insights should reflect patterns, anomalies, opportunities, risks, or strategic observations that would be useful to a business decision-maker.
+
+Each insight must be:
+
+Grounded in the data
+Clearly stated and context-aware
+Framed as a meaningful takeaway
+Suitable for visualization — meaning that each insight should be expressed in a way that allows a graph, chart, or dashboard element to be created from it later (e.g., trends, comparisons, distributions, correlations, rankings, outliers).
+
+Avoid generic statements. Focus on clarity, relevance, and impact.
+
+Your output must strictly be a JSON object keyed by sheet_name, where each value is the insights for that sheet as a single string:
+
+{
+"<sheet_name>": "1. ...\n2. ...",
+"<other sheet_name>": "..."
+}
+"""
+
+VISUALS_SYSTEM_PROMPT = """\
+You are a data visualization assistant. You will be given a JSON array with one entry per sheet of an Excel file.
+Each entry contains the sheet_name, the business insights for that sheet, its column names with their dtypes (columns) and its first few rows (sample_rows).
+Based on the business insights, your task is to generate at most 4 chart or plot suggestions per sheet that can help visualize those insights.
+
+Your output must strictly be a JSON object keyed by sheet_name, structured as follows:
+
+{
+"<sheet_name>": {
+    "chart1": {
+        "plot": {"type": "bar", "x": "column name", "y": "column name", "agg": "sum", "title": "Chart title"},
+        "description": "A short explanation of what the chart reveals."
+    },
+    "chart2": {
+        "plot": {...},
+        "description": "..."
+    }
+}
+}
+
+The "plot" field is a chart specification with these keys:
+- "type": one of "bar", "line", "pie", "scatter", "histogram", "box", "heatmap".
+- "x": the column on the x axis (the category column for bar, pie and box; the value column for histogram).
+- "y": the value column, if the chart needs one.
+- "agg": how "y" is aggregated per "x" value, one of "sum", "mean", "median", "count", "min", "max".
+- "groupby": a column whose values are drawn as separate series (line and scatter only).
+- "value": the column aggregated into the cells of a heatmap with both "x" and "y"; a heatmap without "x" and "y" shows the correlation of the numeric columns.
+- "bins": number of bins for a histogram.
+- "title": a short chart title.
+Leave out any key that does not apply; never use null.
+
+Requirements:
+- Each chart must be based on a specific insight of its own sheet.
+- Use diverse chart types.
+- The "description" field should briefly explain what the chart shows and why it’s useful.
+- Use only the column names listed in columns for that sheet.
+- Do not invent or assume any other columns.
+- Focus on clarity, variety, and relevance to the insights.
+"""
+
 # defining states
 class SheetState(TypedDict):
     sheet_name: str
@@ -25,8 +104,12 @@ class SheetState(TypedDict):
     insights:str
     visuals: Dict[str,Dict[str,Any]]
     pdf_path:str
+    n_charts:int
 
 class DataProfileState(TypedDict):
+    filename:str
+    report_dir:str
+    file_bytes:bytes
     filepath:str
     sheets:List[SheetState]
 
@@ -34,210 +117,222 @@ class DataProfileState(TypedDict):
 graph = StateGraph(DataProfileState)
 
 
-def get_data_profile(state: DataProfileState) -> DataProfileState:
-    filepath = state['filepath']
-    if filepath.endswith('.csv'):
-        df = pd.read_csv(filepath, encoding="utf-8")
-        sheets = {"Sheet1":df}
+def _load_sheets(state: DataProfileState) -> List[SheetState]:
+    # Small uploads arrive in memory, large ones were spilled to disk
+    source = state['file_bytes'] if 'file_bytes' in state else state['filepath']
+    if state['filename'].endswith('.csv'):
+        sheets = {"Sheet1":parse_csv(source)}
     else:
-        sheets = parse_excel(filepath)
+        sheets = parse_excel(source)
     
     sheet_states: List[SheetState] = []
     for sheet_name, df in sheets.items():
-        summary = basic_summary(df)
-        profile  = profile_to_json(df)
+        summary, profile = profile_sheet(df)
         sheet_states.append({
             "sheet_name": sheet_name,
             "summary": summary,
             "profile": profile,
             "df": df
         })
-    state['sheets'] = sheet_states
-
-    return state
-
-
-def generate_insights(state: DataProfileState) -> DataProfileState:
-
-    # Prepare prompt content
-    updated_sheets:List[SheetState] = []
-    for sheet in state["sheets"]:
-        
-        sheet_name = sheet["sheet_name"]
-        summary = sheet["summary"]
-        profile = sheet["profile"]
+    return sheet_states
 
 
-        system_prompt = {
-            "role": "system",
-            "content": """
-            You are a business insights agent. Your role is to generate clear, actionable, and relevant textual insights based on structured data.
+async def get_data_profile(state: DataProfileState) -> DataProfileState:
+    # Parsing and profiling are CPU-bound, so keep them off the event loop
+    state['sheets'] = await asyncio.to_thread(_load_sheets, state)
 
-            You have been provided with two key inputs:
-
-            A basic summary of an Excel file, including row/column counts, data types, missing values, unique values, and sample entries.
-            A data profile description, which includes detailed statistical and structural metadata about the Excel file.
+    return state
 
-            Your task is to analyze this information and generate at most 4 applicable business insights that can be inferred from the data.
-            These insights should reflect patterns, anomalies, opportunities, risks, or strategic observations that would be useful to a business decision-maker.
 
-            Each insight must be:
+def _cache_key(messages: List[Dict[str,str]], temperature: float, max_tokens: int) -> str:
+    return hashlib.sha256(
+        orjson.dumps({"messages": messages, "temperature": temperature, "max_tokens": max_tokens, "response_format": "json_object"}, option=orjson.OPT_SORT_KEYS)
+    ).hexdigest()
 
-            Grounded in the data
-            Clearly stated and context-aware
-            Framed as a meaningful takeaway
-            Suitable for visualization — meaning that each insight should be expressed in a way that allows a graph, chart, or dashboard element to be created from it later (e.g., trends, comparisons, distributions, correlations, rankings, outliers).
 
-            Avoid generic statements. Focus on clarity, relevance, and impact.
-            """
-        }
+async def _chat_completion_stream(messages: List[Dict[str,str]], temperature: float, max_tokens: int) -> AsyncIterator[str]:
 
-        user_prompt = {
-            "role": "user",
-            "content": f"Sheet:{sheet_name}\n Summary:{summary}\n Profile:{profile}"
-        }
+    key = _cache_key(messages, temperature, max_tokens)
+    cached = llm_cache.get(key)
+    if cached is not None:
+        yield cached
+        return
 
-        response = client.chat.completions.create(
-            messages=[system_prompt, user_prompt],
-            max_tokens=4096,
-            temperature=1.0,
+    chunks: List[str] = []
+    finish_reason = None
+    async with llm_semaphore:
+        stream = await client.chat.completions.create(
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
             top_p=1.0,
-            model="gpt-4o"
+            model="gpt-4o",
+            response_format={"type": "json_object"},
+            stream=True
         )
-
-        sheet['insights'] = response.choices[0].message.content
-        updated_sheets.append(sheet)
-        state["sheets"] = updated_sheets
-
-    return state
-
-
-
-def suggest_plots(state: DataProfileState) -> DataProfileState:
-
-    updated_sheets:List[SheetState] = []
-    for sheet in state['sheets']:
-
-        user_prompt = {
-            'role': 'user',
-            'content': f"Business Insights: {sheet['insights']}"
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            if chunk.choices[0].finish_reason:
+                finish_reason = chunk.choices[0].finish_reason
+            if chunk.choices[0].delta.content:
+                chunks.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+
+    # A reply cut off by max_tokens or the content filter is incomplete JSON, so it must not be cached
+    if finish_reason != "stop":
+        raise RuntimeError(f"LLM response incomplete (finish_reason={finish_reason})")
+    llm_cache.set(key, "".join(chunks))
+
+
+async def _stream_json_members(messages: List[Dict[str,str]], temperature: float, max_tokens: int) -> AsyncIterator[Tuple[str,Any]]:
+
+    # Yields each top-level member of the streamed JSON object as soon as its value is complete,
+    # tracking nesting depth and string state so commas and braces inside values are ignored
+    text = ""
+    pos = 0
+    depth = 0
+    in_string = False
+    escape = False
+    member_start = None
+
+    async for delta in _chat_completion_stream(messages, temperature, max_tokens):
+        text += delta
+        while pos < len(text):
+            ch = text[pos]
+            if in_string:
+                if escape:
+                    escape = False
+                elif ch == "\\":
+                    escape = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch in "{[":
+                depth += 1
+                if depth == 1:
+                    member_start = pos + 1
+            elif ch in "}]" or (ch == "," and depth == 1):
+                if depth == 1 and member_start is not None:
+                    member = text[member_start:pos]
+                    if member.strip():
+                        for item in orjson.loads("{" + member + "}").items():
+                            yield item
+                    member_start = pos + 1
+                if ch != ",":
+                    depth -= 1
+            pos += 1
+
+
+def _insights_messages(sheets: List[SheetState]) -> List[Dict[str,str]]:
+
+    system_prompt = {
+        "role": "system",
+        "content": INSIGHTS_SYSTEM_PROMPT
+    }
+
+    payload = [
+        {"sheet_name": sheet["sheet_name"], "summary": sheet["summary"], "profile": sheet["profile"]}
+        for sheet in sheets
+    ]
+    user_prompt = {
+        "role": "user",
+        "content": orjson.dumps(payload, default=str, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY).decode()
+    }
+
+    return [system_prompt, user_prompt]
+
+
+async def _batch_insights(sheets: List[SheetState]) -> Dict[str,str]:
+
+    return {
+        name: "\n".join(text) if isinstance(text, list) else str(text)
+        async for name, text in _stream_json_members(_insights_messages(sheets), temperature=1.0, max_tokens=MAX_OUTPUT_TOKENS)
+    }
+
+
+async def _batch_visuals(sheets: List[SheetState]) -> AsyncIterator[Tuple[str,Dict[str,Dict[str,Any]]]]:
+
+    system_prompt = {
+        'role': 'system',
+        'content': VISUALS_SYSTEM_PROMPT
+    }
+
+    payload = [
+        {
+            "sheet_name": sheet["sheet_name"],
+            "insights": sheet["insights"],
+            "columns": {str(c): str(dtype) for c, dtype in sheet["df"].dtypes.items()},
+            "sample_rows": sheet["df"].head(5).to_dict(orient="records")
         }
+        for sheet in sheets
+    ]
+    user_prompt = {
+        'role': 'user',
+        'content': orjson.dumps(payload, default=str, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY).decode()
+    }
+
+    # Hand out each sheet's charts as soon as they have been streamed in full
+    async for sheet_name, visuals in _stream_json_members([system_prompt, user_prompt], temperature=0, max_tokens=MAX_OUTPUT_TOKENS):
+        yield sheet_name, visuals
+
+
+def _start_render(loop: asyncio.AbstractEventLoop, report_dir: str, sheet: SheetState, visuals: Dict[str,Dict[str,Any]]) -> "asyncio.Future[int]":
+    pdf_filename = os.path.join(report_dir, f"{sheet['sheet_name']}.pdf")
+    return loop.run_in_executor(process_executor, render_sheet_pdf, pdf_filename, sheet['sheet_name'], sheet['df'], visuals)
+
+
+async def process_batch(sheets: List[SheetState], report_dir: str) -> List[SheetState]:
+
+    # Each batch moves to its next stage as soon as its own previous stage is done,
+    # without waiting on the other batches
+    insights = await _batch_insights(sheets)
+    for sheet in sheets:
+        sheet['insights'] = insights.get(sheet['sheet_name'], "")
+
+    # Render in worker processes instead of blocking the event loop, so CPU-bound drawing overlaps
+    # with pending LLM calls, starting each sheet
+    # while the charts of the later sheets are still being generated
+    loop = asyncio.get_running_loop()
+    by_name = {sheet['sheet_name']: sheet for sheet in sheets}
+    renders = {}
+    try:
+        async for sheet_name, visuals in _batch_visuals(sheets):
+            sheet = by_name.get(sheet_name)
+            if sheet is None or sheet_name in renders:
+                continue
+            sheet['visuals'] = visuals
+            renders[sheet_name] = _start_render(loop, report_dir, sheet, visuals)
+    except Exception as e:
+        # Sheets that were streamed in full still get their reports, the rest fall back to empty ones
+        print(f"Plot suggestion failed for {', '.join(by_name)}: {e}")
 
-        df = sheet['df']
-        df_columns = list(df.columns)
-
-        system_prompt = {
-            'role': 'system',
-            'content': f"""
-                    You are a data visualization assistant. Based on the business insights provided to you, your task is to generate at most 4 chart or plot suggestions that can help visualize those insights.
-
-                    Your output must strictly be a JSON object structured as follows:
-
-                    {{
-                    "chart1": {{
-                        "plot": "matplotlib code as a string",
-                        "description": "A short explanation of what the chart reveals."
-                    }},
-                    "chart2": {{
-                        "plot": "...",
-                        "description": "..."
-                    }}
-                    }}
-
-                    Requirements:
-                    - Each chart must be based on a specific insight.
-                    - Use diverse chart types (e.g., bar, line, pie, scatter, histogram, box plot, heatmap, etc.).
-                    - The "plot" field must contain valid Python matplotlib code as a string that can be executed to generate the chart.
-                    - The "description" field should briefly explain what the chart shows and why it’s useful.
-                    - Use the following DataFrame: {df}
-                    - Use only the column names of the DataFrame: {df_columns}
-                    - Do not invent or assume any other columns.
-                    - Do not include placeholder data — assume the data is already loaded in df.
-                    - Focus on clarity, variety, and relevance to the insights.
-                    - Always assign the figure to a variable using fig = plt.figure() and plot on that figure. Do not rely on implicit figure creation.
-                    """
-                        }
-        response = client.chat.completions.create(
-            messages=[system_prompt, user_prompt],
-            max_tokens=4096,
-            temperature=0,
-            top_p=1.0,
-            model="gpt-4o"
-        )
-        raw = response.choices[0].message.content
+    for sheet in sheets:
+        if sheet['sheet_name'] not in renders:
+            sheet['visuals'] = {}
+            renders[sheet['sheet_name']] = _start_render(loop, report_dir, sheet, {})
 
-        # Remove Markdown code block markers
-        if raw.startswith("```json"):
-            raw = raw[len("```json"):].strip()
-        if raw.endswith("```"):
-            raw = raw[:-len("```")].strip()
+    for sheet in sheets:
+        sheet["n_charts"] = await renders[sheet['sheet_name']]
+        sheet["pdf_path"] = os.path.relpath(os.path.join(report_dir, f"{sheet['sheet_name']}.pdf"), REPORT_DIR)
+    return sheets
 
-        # Now safely parse
-        sheet['visuals']= ast.literal_eval(raw)
-        updated_sheets.append(sheet)
-        state["sheets"] = updated_sheets
 
-    return state
+async def make_reports(state: DataProfileState) -> DataProfileState:
 
-def make_plots(state: DataProfileState) -> DataProfileState:
-
-    updated_sheets:List[SheetState] = []
-    for sheet in state['sheets']:
-        df = sheet["df"]
-        images_with_descriptions = []
-        for chart_name, chart in sheet["visuals"].items():
-            plot_code = chart.get("plot","").replace("plt.show()", "")
-            description = chart.get("description","")
-
-                        # Execute the matplotlib code
-            local_scope = {"df": df, "plt": plt, "pd": pd}
-            try:
-                exec(plot_code, {}, local_scope)
-            except Exception as e:
-                print(f"Error executing plot code for {chart_name}: {e}")
-                continue
+    # Several sheets share one LLM request to amortize the per-request overhead
+    batches = [state["sheets"][i:i + SHEET_BATCH_SIZE] for i in range(0, len(state["sheets"]), SHEET_BATCH_SIZE)]
+    os.makedirs(state["report_dir"], exist_ok=True)
+    results = await asyncio.gather(*(process_batch(batch, state["report_dir"]) for batch in batches), return_exceptions=True)
 
+    for batch, result in zip(batches, results):
+        if isinstance(result, Exception):
+            names = ", ".join(sheet['sheet_name'] for sheet in batch)
+            print(f"Report generation failed for {names}: {result}")
 
-            # Get the most recent figure created by the executed code
-            figs = [plt.figure(n) for n in plt.get_fignums()]
-            if figs:
-                fig = figs[-1]
-                buf = BytesIO()
-                fig.savefig(buf, format='png')
-                buf.seek(0)
-                images_with_descriptions.append((buf, description))
-                plt.close(fig)
-            else:
-                print(f"No figure generated for {chart_name} in {sheet['sheet_name']}")
-        
-        pdf_filename = os.path.join(REPORT_DIR, f"{sheet['sheet_name']}.pdf")
-
-        c = canvas.Canvas(pdf_filename,pagesize=A4)
-        width, height = A4
-
-        for img_buf, description in images_with_descriptions:
-            img = ImageReader(img_buf)
-            img_width = 5.5 * inch
-            img_height = 4.5 * inch
-            x = (width - img_width) / 2
-            y = height - img_height - 100
-
-            # Draw image
-            c.drawImage(img, x, y, width=img_width, height=img_height, preserveAspectRatio=True)
-
-            # Draw description below image
-            text_x = 50
-            text_y = y - 40
-            c.setFont("Helvetica", 11)
-            c.drawString(text_x, text_y, description)
-
-            c.showPage()
-
-        c.save()
-        sheet["pdf_path"] = os.path.basename(pdf_filename)
-        updated_sheets.append(sheet)
-        state["sheets"] = updated_sheets
+    # The DataFrames are no longer needed once the PDFs exist, so keep them out of the final state
+    for sheet in state["sheets"]:
+        sheet.pop("df", None)
 
     return state
-
-
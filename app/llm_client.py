@@ -1,4 +1,5 @@
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI
+import asyncio
 import os
 from dotenv import load_dotenv
 
@@ -12,14 +13,18 @@ subscription_key = os.getenv("AZURE_OPENAI_API_KEY")
 deployment = os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4o")
 api_version = "2024-12-01-preview"
 
+# Cap on concurrent chat completion requests, keeps per-sheet fan-out under the deployment rate limit
+max_concurrency = int(os.getenv("AZURE_OPENAI_MAX_CONCURRENCY", "8"))
+llm_semaphore = asyncio.Semaphore(max_concurrency)
+
 try:
-    client = AzureOpenAI(
+    client = AsyncAzureOpenAI(
         api_version=api_version,
         azure_endpoint=endpoint,
         api_key=subscription_key,
     )
 except Exception as e:
-    print(f"Failed to initialize AzureOpenAI client: {e}")
+    print(f"Failed to initialize AsyncAzureOpenAI client: {e}")
     client = None
 
 
@@ -1,16 +1,17 @@
-from fastapi import FastAPI, UploadFile, File
-from fastapi.responses import JSONResponse, FileResponse, HTMLResponse
+from fastapi import FastAPI, UploadFile, File, Request
+from fastapi.responses import JSONResponse, FileResponse, HTMLResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import os
-import shutil
+import hashlib
+import json
+import re
+import aiofiles
 from typing import List
 from langgraph.graph import StateGraph, START, END
 from app.langgraph_nodes import (
     get_data_profile,
-    generate_insights,
-    suggest_plots,
-    make_plots,
+    make_reports,
     DataProfileState
 )
 
@@ -20,6 +21,12 @@ UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
 REPORT_DIR = os.path.join(BASE_DIR, "generated_reports")
 STATIC_DIR = os.path.join(BASE_DIR, "static")
 
+# Read uploads in 1 MiB chunks
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Uploads up to this size are profiled straight from memory
+MAX_IN_MEMORY_UPLOAD = 50 * 1024 * 1024
+
 # Ensure folders exist
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(REPORT_DIR, exist_ok=True)
@@ -50,15 +57,11 @@ async def serve_index():
 # Create LangGraph workflow
 graph = StateGraph(DataProfileState)
 graph.add_node('get_data_profile', get_data_profile)
-graph.add_node('get_textual_insights', generate_insights)
-graph.add_node('get_visualization_code', suggest_plots)
-graph.add_node('get_pdf_report', make_plots)
+graph.add_node('get_pdf_reports', make_reports)
 
 graph.add_edge(START, 'get_data_profile')
-graph.add_edge('get_data_profile', 'get_textual_insights')
-graph.add_edge('get_textual_insights', 'get_visualization_code')
-graph.add_edge('get_visualization_code', 'get_pdf_report')
-graph.add_edge('get_pdf_report', END)
+graph.add_edge('get_data_profile', 'get_pdf_reports')
+graph.add_edge('get_pdf_reports', END)
 
 workflow = graph.compile()
 
@@ -69,18 +72,35 @@ async def upload_file(file: UploadFile = File(...)):
     if not file.filename.endswith((".csv", ".xlsx", ".xls")):
         return JSONResponse(content={"error": "Invalid file type"}, status_code=400)
 
-    # Save uploaded file
-    file_path = os.path.join(UPLOAD_DIR, file.filename)
+    # Keep small uploads in memory, save large ones to disk, hashing the content either way
+    initial_state = {"filename": file.filename}
+    file_hash = hashlib.blake2b()
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        if file.size is not None and file.size <= MAX_IN_MEMORY_UPLOAD:
+            data = await file.read()
+            file_hash.update(data)
+            initial_state["file_bytes"] = data
+        else:
+            file_path = os.path.join(UPLOAD_DIR, file.filename)
+            async with aiofiles.open(file_path, "wb") as buffer:
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    file_hash.update(chunk)
+                    await buffer.write(chunk)
+            initial_state["filepath"] = file_path
     except Exception as e:
         return JSONResponse(content={"error": f"File upload failed: {e}"}, status_code=500)
 
+    # Reports are stored per file content, so an identical upload reuses them
+    report_dir = os.path.join(REPORT_DIR, file_hash.hexdigest())
+    manifest_path = os.path.join(report_dir, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return JSONResponse(content={"success": True, "pdfs": json.load(f)["pdfs"]})
+
     # Run LangGraph workflow
     try:
-        initial_state = {"filepath": file_path}
-        final_state = workflow.invoke(initial_state)
+        initial_state["report_dir"] = report_dir
+        final_state = await workflow.ainvoke(initial_state)
     except Exception as e:
         return JSONResponse(content={"success": False, "error": f"Workflow failed: {e}"}, status_code=500)
 
@@ -92,12 +112,29 @@ async def upload_file(file: UploadFile = File(...)):
         if pdf_path and os.path.exists(pdf_path):
             pdfs.append(pdf_name)
 
+    # Only reuse a complete set of reports where every sheet got at least one chart,
+    # so a blank report from a truncated reply or failed charts can be retried
+    sheets = final_state.get("sheets", [])
+    if pdfs and len(pdfs) == len(sheets) and all(sheet.get("n_charts", 0) > 0 for sheet in sheets):
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump({"filename": file.filename, "pdfs": pdfs}, f)
+
     return JSONResponse(content={"success": True, "pdfs": pdfs})
 
 # Download endpoint
-@app.get("/download/{pdf_name}")
-async def download_pdf(pdf_name: str):
-    pdf_path = os.path.join(REPORT_DIR, pdf_name)
+@app.get("/download/{file_hash}/{pdf_name}")
+async def download_pdf(file_hash: str, pdf_name: str, request: Request):
+    # Only serve reports inside REPORT_DIR: a blake2b hex digest and a bare .pdf file name
+    if not re.fullmatch(r"[0-9a-f]{128}", file_hash) or pdf_name != os.path.basename(pdf_name) or not pdf_name.endswith(".pdf"):
+        return JSONResponse(content={"error": "File not found"}, status_code=404)
+    pdf_path = os.path.join(REPORT_DIR, file_hash, pdf_name)
     if os.path.exists(pdf_path):
-        return FileResponse(pdf_path, media_type="application/pdf", filename=pdf_name)
+        # Let browsers revalidate instead of downloading an unchanged report again
+        stat = os.stat(pdf_path)
+        etag = '"' + hashlib.md5(f"{stat.st_size}-{stat.st_mtime_ns}".encode()).hexdigest() + '"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if_none_match = request.headers.get("if-none-match", "")
+        if etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")):
+            return Response(status_code=304, headers=headers)
+        return FileResponse(pdf_path, media_type="application/pdf", filename=pdf_name, headers=headers, stat_result=stat)
     return JSONResponse(content={"error": "File not found"}, status_code=404)
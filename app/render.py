@@ -0,0 +1,63 @@
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import pandas as pd
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader
+from reportlab.lib.units import inch
+from io import BytesIO
+from typing import Dict, Any
+from app.charts import render_chart
+
+# Kept free of the LLM client and workflow imports, since every worker process
+# imports this module to unpickle render_sheet_pdf
+
+
+# Writes one PDF page per chart and returns how many charts were drawn
+def render_sheet_pdf(pdf_filename: str, sheet_name: str, df: pd.DataFrame, visuals: Dict[str,Dict[str,Any]]) -> int:
+
+    # The page font is set once here and survives showPage()
+    c = canvas.Canvas(pdf_filename,pagesize=A4, initialFontName="Helvetica", initialFontSize=11)
+    width, height = A4
+
+    # Page layout is the same for every chart
+    img_width = 5.5 * inch
+    img_height = 4.5 * inch
+    x = (width - img_width) / 2
+    y = height - img_height - 100
+    text_x = 50
+    text_y = y - 40
+
+    # One figure and one PNG buffer are reused for every chart of the sheet,
+    # sized to the image box so the PDF never rescales it
+    fig = plt.figure(figsize=(img_width / inch, img_height / inch), dpi=100)
+    buf = BytesIO()
+    n_charts = 0
+
+    for chart_name, chart in visuals.items():
+        description = chart.get("description","")
+
+        try:
+            render_chart(df, chart.get("plot", {}), fig)
+        except Exception as e:
+            print(f"Error rendering {chart_name} in {sheet_name}: {e}")
+            continue
+
+        buf.seek(0)
+        buf.truncate(0)
+        fig.savefig(buf, format='png', dpi=100)
+        buf.seek(0)
+
+        # Draw image
+        c.drawImage(ImageReader(buf), x, y, width=img_width, height=img_height)
+
+        # Draw description below image
+        c.drawString(text_x, text_y, description)
+
+        c.showPage()
+        n_charts += 1
+
+    plt.close(fig)
+    c.save()
+    return n_charts
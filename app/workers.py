@@ -0,0 +1,10 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+
+# One long-lived worker pool shared by sheet parsing and chart rendering, so no request pays
+# process startup. Workers come from a forkserver rather than being forked from the threaded server.
+process_executor = ProcessPoolExecutor(
+    max_workers=os.cpu_count(),
+    mp_context=multiprocessing.get_context("forkserver"),
+)
@@ -0,0 +1,23 @@
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import pandas as pd
+
+from app.charts import render_chart
+
+
+def test_line_after_pie_on_same_figure_gets_fresh_axes():
+    df = pd.DataFrame({"month": [1, 2, 3, 4, 5, 6], "sales": [10, 20, 15, 30, 25, 40]})
+    fig = plt.figure(figsize=(5.5, 4.5), dpi=100)
+    try:
+        render_chart(df, {"type": "pie", "x": "month", "y": "sales"}, fig)
+        render_chart(df, {"type": "line", "x": "month", "y": "sales"}, fig)
+
+        assert len(fig.axes) == 1
+        ax = fig.axes[0]
+        assert ax.get_aspect() == "auto"
+        assert ax.axison and ax.get_frame_on()
+        left, right = ax.get_xlim()
+        assert 0 <= left < 1 and 6 < right <= 7
+    finally:
+        plt.close(fig)
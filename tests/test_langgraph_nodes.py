@@ -0,0 +1,35 @@
+import asyncio
+
+import orjson
+
+import app.langgraph_nodes as nodes
+
+
+DOCUMENT = {
+    "Sales": {"chart_1": {"description": "Revenue {by} region, \"quoted\"", "plot": {"type": "bar", "x": "region", "y": "sales"}}},
+    "Costs, Q1": ["line one \\ with a backslash", "line two, with [brackets]"],
+    "Notes": "escaped \\\" quote and a } brace",
+    "Count": 3,
+}
+
+
+def _members(text, size, monkeypatch):
+    async def fake_stream(messages, temperature, max_tokens):
+        for i in range(0, len(text), size):
+            yield text[i:i + size]
+
+    async def collect():
+        return [item async for item in nodes._stream_json_members([], temperature=0, max_tokens=1)]
+
+    monkeypatch.setattr(nodes, "_chat_completion_stream", fake_stream)
+    return asyncio.run(collect())
+
+
+def test_stream_json_members_matches_document_for_any_delta_split(monkeypatch):
+    text = orjson.dumps(DOCUMENT, option=orjson.OPT_INDENT_2).decode()
+    for size in (1, 2, 3, 7, len(text)):
+        assert _members(text, size, monkeypatch) == list(DOCUMENT.items())
+
+
+def test_stream_json_members_empty_object(monkeypatch):
+    assert _members("{ }", 1, monkeypatch) == []
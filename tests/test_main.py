@@ -0,0 +1,36 @@
+import asyncio
+import os
+
+from fastapi import Request
+from fastapi.testclient import TestClient
+
+import app.main as main
+
+
+def _request(headers=()):
+    return Request({"type": "http", "headers": [(k.encode(), v.encode()) for k, v in headers]})
+
+
+def test_download_rejects_path_traversal():
+    client = TestClient(main.app)
+    assert client.get("/download/..%2f../x.pdf").status_code == 404
+    assert client.get("/download/..%2f..%2fapp/main.py").status_code == 404
+
+    for file_hash, pdf_name in (("..", "main.py"), ("..", "x.pdf"), ("a" * 128, "../x.pdf"), ("a" * 128, "report.txt")):
+        response = asyncio.run(main.download_pdf(file_hash, pdf_name, _request()))
+        assert response.status_code == 404
+
+
+def test_download_revalidates_with_etag(tmp_path, monkeypatch):
+    file_hash = "a" * 128
+    os.makedirs(tmp_path / file_hash)
+    (tmp_path / file_hash / "Sheet1.pdf").write_bytes(b"%PDF-1.4\n")
+    monkeypatch.setattr(main, "REPORT_DIR", str(tmp_path))
+
+    client = TestClient(main.app)
+    response = client.get(f"/download/{file_hash}/Sheet1.pdf")
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == "no-cache"
+
+    response = client.get(f"/download/{file_hash}/Sheet1.pdf", headers={"If-None-Match": response.headers["etag"]})
+    assert response.status_code == 304
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+from app.langgraph_nodes import MAX_OUTPUT_TOKENS, _cache_key, _insights_messages
+from app.profiler import parse_csv, profile_sheet
+
+
+def _key(df):
+    # The LLM cache key of the insights request built from this sheet's profile
+    summary, profile = profile_sheet(df)
+    sheets = [{"sheet_name": "Sheet1", "summary": summary, "profile": profile}]
+    return _cache_key(_insights_messages(sheets), temperature=1.0, max_tokens=MAX_OUTPUT_TOKENS)
+
+
+def test_same_dataframe_gives_same_cache_key():
+    # More rows than the profiling sample limit, so the sampling path is exercised
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame({
+        "region": rng.choice(["north", "south", "east", "west"], size=25000),
+        "sales": rng.normal(100, 20, size=25000),
+        "units": rng.integers(0, 50, size=25000),
+    })
+
+    assert _key(df) == _key(df.copy())
+
+
+def test_profile_without_numeric_columns():
+    df = pd.DataFrame({
+        "city": ["Oslo", "Lima", "Oslo", None],
+        "joined": pd.to_datetime(["2024-01-05", "2024-02-10", None, "2024-03-15"]),
+    })
+    _, profile = profile_sheet(df)
+    assert "error" not in profile
+    assert profile["numeric"] == {}
+    assert profile["strong_correlations"] == []
+    assert profile["categorical"]["city"] == {"Oslo": 2, "Lima": 1}
+    assert profile["datetime"]["joined"] == {"min": "2024-01-05 00:00:00", "max": "2024-03-15 00:00:00"}
+
+    _, profile = profile_sheet(df[["city"]])
+    assert "error" not in profile
+    assert profile["categorical"]["city"] == {"Oslo": 2, "Lima": 1}
+
+
+def test_parse_csv_with_ragged_rows():
+    df = parse_csv(b"a,b,c\n1,2,3\n4,5\n")
+    assert list(df.columns) == ["a", "b", "c"]
+    assert df.shape == (2, 3)
+    assert df["c"].isna().tolist() == [False, True]